@@ -1,17 +1,111 @@
-from PIL import Image
-from fastapi import FastAPI, BackgroundTasks
-from fastapi.responses import JSONResponse
+import asyncio
+import os
+import sys
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import FastAPI, File, Form, UploadFile
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool
+import orjson
 import uvicorn
-import requests
 import utils
+from config import BATCH_MAX_SIZE, BATCH_TIMEOUT, MEMORY_BATCH_MAX_SIZE, LENGTH_BUCKET_MAX_TOKENS
 from src.multimodal import Multimodal
 
-app = FastAPI()
-MultiModal = Multimodal(debug=True)
+# DEBUG=0 silences the agent's verbose console tracing
+DEBUG = os.getenv("DEBUG", "1") == "1"
+MultiModal = Multimodal(debug=DEBUG)
+
+def predict_length_bucket(text: str, n_images: int, is_mentioned: bool) -> str:
+    """Cheap guess of the reply length ("S", "M" or "L") used to group similar requests."""
+    if n_images or len(text) > 200:
+        return "L"
+    if is_mentioned or len(text) > 40:
+        return "M"
+    return "S"
+
+async def batch_worker(queue: asyncio.Queue):
+    """Coalesces queued chat requests into batches and resolves each request's future."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + BATCH_TIMEOUT
+        while len(batch) < BATCH_MAX_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        payloads = [payload for payload, _ in batch]
+        try:
+            results = await loop.run_in_executor(None, MultiModal.generate_response_batch, payloads)
+        except Exception as e:
+            # Fail this batch's requests, but keep the worker alive for the rest of the bucket
+            print(f"Batch worker failed: {e}")
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        for (_, fut), result in zip(batch, results):
+            if fut.done():  # Client went away
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+async def memory_writer(queue: asyncio.Queue):
+    """Single consumer for memory saving, so writes never contend with each other."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        try:
+            while len(batch) < MEMORY_BATCH_MAX_SIZE:
+                batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            pass
+
+        try:
+            await loop.run_in_executor(None, MultiModal.save_memory_batch, batch)
+        except Exception as e:
+            print(f"Memory writer failed: {e}")
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One queue and batch worker per predicted length bucket
+    app.state.req_qs = {bucket: asyncio.Queue() for bucket in LENGTH_BUCKET_MAX_TOKENS}
+    app.state.mem_q = asyncio.Queue()
+    workers = [asyncio.create_task(batch_worker(q)) for q in app.state.req_qs.values()]
+    writer = asyncio.create_task(memory_writer(app.state.mem_q))
+    yield
+    for worker in workers:
+        worker.cancel()
+    # Let pending memories settle before shutting down
+    try:
+        await asyncio.wait_for(app.state.mem_q.join(), timeout=30)
+    except asyncio.TimeoutError:
+        pass
+    writer.cancel()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Chat endpoint
 @app.post("/chat/")
-async def chat_endpoint(request: utils.ChatRequest, background_tasks: BackgroundTasks):
+async def chat_endpoint(
+    payload: str = Form(...),
+    images: List[UploadFile] = File(default=[])
+):
+    # Multipart body: JSON-encoded ChatRequest plus raw image files (no base64)
+    request = utils.ChatRequest.model_validate_json(payload)
+    image_bytes = [await image.read() for image in images]
+
     # Get the text and image path from the request
     text = request.text
     image_paths = request.image_paths
@@ -19,28 +113,65 @@ async def chat_endpoint(request: utils.ChatRequest, background_tasks: Background
     username = request.username
     is_mentioned = request.is_mentioned
     
-    response, bg_data = MultiModal.generate_response(
-        text, 
-        image_paths, 
-        user_id=user_id, 
-        username=username, 
-        is_mentioned=is_mentioned
-    )
+    # Queue for the batch worker of our length bucket and wait for our slot of the batch
+    bucket = predict_length_bucket(text, len(image_bytes) + len(image_paths or []), is_mentioned)
+    fut = asyncio.get_running_loop().create_future()
+    await app.state.req_qs[bucket].put(({
+        "text": text,
+        "image_paths": image_paths,
+        "user_id": user_id,
+        "username": username,
+        "is_mentioned": is_mentioned,
+        "image_bytes": image_bytes,
+        "max_tokens": LENGTH_BUCKET_MAX_TOKENS[bucket]
+    }, fut))
+    response, bg_data = await fut
     
-    # Offload memory saving to background task
-    background_tasks.add_task(MultiModal.save_memory_background, bg_data)
+    # Offload memory saving to the background writer
+    app.state.mem_q.put_nowait(bg_data)
     
     if 'img' in response:
-        return JSONResponse(content={"response": response['response'], "img": response['img']})
+        return ORJSONResponse(content={"response": response['response'], "img": response['img']})
     else:
-        return JSONResponse(content={"response": response['response']})
+        return ORJSONResponse(content={"response": response['response']})
+
+async def sse_wrap(events):
+    """Formats generate_response_stream events as server-sent events."""
+    async for event in iterate_in_threadpool(events):
+        if "result" in event:
+            # Final event: hand memory saving to the writer, send the full response
+            app.state.mem_q.put_nowait(event["background"])
+            event = event["result"]
+        yield f"data: {orjson.dumps(event).decode()}\n\n"
+
+# Streaming chat endpoint: {"delta": ...} events, then the final {"response": ..., "img": ...}
+@app.post("/chat/stream/")
+async def chat_stream_endpoint(
+    payload: str = Form(...),
+    images: List[UploadFile] = File(default=[])
+):
+    request = utils.ChatRequest.model_validate_json(payload)
+    image_bytes = [await image.read() for image in images]
+
+    events = MultiModal.generate_response_stream(
+        request.text,
+        request.image_paths,
+        user_id=request.user_id,
+        username=request.username,
+        is_mentioned=request.is_mentioned,
+        image_bytes=image_bytes
+    )
+    return StreamingResponse(sse_wrap(events), media_type="text/event-stream")
 
 @app.get("/user/{user_id}/details")
 async def get_user_details(user_id: str):
     details = MultiModal.get_user_details(user_id)
-    return JSONResponse(content=details)
+    return ORJSONResponse(content=details)
 
 
 if __name__ == "__main__":
     # Initialize FastAPI app
-    uvicorn.run(app, host="0.0.0.0", port=8119)
\ No newline at end of file
+    # uvloop has no Windows build; fall back to the stock asyncio loop there.
+    # A single worker is used because MultiModal keeps per-process state (history, karma).
+    loop = "asyncio" if sys.platform == "win32" else "uvloop"
+    uvicorn.run(app, host="0.0.0.0", port=8119, loop=loop, http="httptools")
\ No newline at end of file
@@ -5,17 +5,47 @@ DISCORD_TOKEN = '<API_TOKEN>'
 CHROMA_DB_PATH = "./memories/chroma.db"
 COLLECTION_NAME = "v02haha"
 HISTORY_MAXLEN = 100
+## KARMA_FLUSH_DELAY: karma.json is written at most this many seconds after a change (bursts coalesce)
+KARMA_FLUSH_DELAY = 1.0
+## HISTORY_COMPACT_LINES: chat_history.jsonl is rewritten as a snapshot once it has this many lines
+HISTORY_COMPACT_LINES = 5000
 
 ## CONTEXT_LENGTH_IMAGE is the number of previous images that will be used to generate the response
 CONTEXT_LENGTH_IMAGE = 2
 CONTEXT_LENGTH_TEXT = 5
 MAX_USER_INPUT_IMAGES = 2
+## MAX_IMAGE_SIDE: larger input images are downscaled (longest side, pixels) before reaching the model
+MAX_IMAGE_SIDE = 1024
 
 ## MAX TOKEN SETTINGS
 MAX_TOKENS_MEMORY = 600    # For memory extraction
 MAX_TOKENS_SUMMARY = 600   # For user summary updates
 MAX_TOKENS_RESPONSE = 600  # For main agent response
 
+## REQUEST BATCHING (api.py)
+BATCH_MAX_SIZE = 8     # Max /chat/ requests coalesced into one dispatch
+BATCH_TIMEOUT = 0.02   # Seconds to wait for more requests before dispatching
+MEMORY_BATCH_MAX_SIZE = 64  # Max queued turns saved per memory-writer pass
+## LENGTH_BUCKET_MAX_TOKENS: requests are batched with others of similar predicted
+## reply length; each bucket caps the response tokens accordingly
+LENGTH_BUCKET_MAX_TOKENS = {"S": 256, "M": 512, "L": MAX_TOKENS_RESPONSE}
+
+## PASSIVE_REPLIES: answer every guild message; set False to only answer mentions/replies to the bot
+PASSIVE_REPLIES = True
+## STREAM_RESPONSES makes the Discord bot use /chat/stream/ and edit its reply as text arrives.
+## Streamed turns skip the micro-batcher, its length-bucket max_tokens caps and batched RAG embeddings.
+STREAM_RESPONSES = False
+STREAM_EDIT_INTERVAL = 0.5  # Seconds between message edits while streaming
+## MAX_INFLIGHT_REQUESTS caps how many chat requests the Discord bot has open against the API at once
+MAX_INFLIGHT_REQUESTS = 2 * BATCH_MAX_SIZE
+PROFILE_CACHE_TTL = 10  # Seconds the bot reuses a fetched /profile result
+
+## LLM_MAX_CONNECTIONS caps the HTTP/2 connection pool to the Gemini chat endpoint
+LLM_MAX_CONNECTIONS = 16
+
+## PROMPT_WARMUP sends SYSTEM_PROMPT once at startup to prime the backend's prefix cache
+PROMPT_WARMUP = True
+
 ## NAME is the name of the character that the model will be trained to generate responses for
 NAME = 'NuAnantachai'
 
@@ -105,6 +135,13 @@ You: "Get out of my face. {karma-}"
 
 THRESHOLD = 1
 MEMORY_RECALL_COUNT = 2
+## RAG_CACHE_*: a query whose embedding is this similar (cosine) to a recent one for the same
+## user reuses that query's retrieved context instead of hitting ChromaDB
+RAG_CACHE_SIZE = 512
+RAG_CACHE_SIMILARITY = 0.97
+## LOCAL_SEARCH_MAX_MEMORIES: users with at most this many memories are searched in-process
+## (NumPy over a cached matrix) instead of through a ChromaDB query
+LOCAL_SEARCH_MAX_MEMORIES = 2000
 
 # (Removed separate IMAGE_DECISION_PROMPT to save tokens and avoid logic conflicts)
 IMAGE_DECISION_PROMPT = "" 
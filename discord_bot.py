@@ -1,107 +1,210 @@
-from typing import Final
+from typing import Final, Optional, Tuple
+import asyncio
+import io
+import logging
 import os
-import requests
+import queue
+import re
+import time
+from logging.handlers import QueueHandler, QueueListener
 from dotenv import load_dotenv
-from discord import Intents, Client, Message, File, ChannelType, Embed, Color, Interaction, app_commands
-from utils.responses import get_response, get_user_profile_data
-import base64
-from PIL import Image
-from io import BytesIO
+from discord import Intents, Message, File, ChannelType, Embed, Color, Interaction
+from discord.ext import commands
+from utils.responses import get_response, get_response_stream, get_user_profile_data
+try:
+    import pybase64 as base64  # SIMD codec, drop-in for the stdlib module
+except ImportError:
+    import base64
 from utils import ChatRequest
-from config import DISCORD_TOKEN
+from config import DISCORD_TOKEN, STREAM_RESPONSES, STREAM_EDIT_INTERVAL, PASSIVE_REPLIES
 
 # STEP 0: LOAD OUR TOKEN FROM SOMEWHERE SAFE
 load_dotenv()
 TOKEN: Final[str] = os.getenv("DISCORD_TOKEN")
 
+# Log records are only enqueued on the event loop; a listener thread writes them out
+log = logging.getLogger("ananbot")
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log.addHandler(QueueHandler(_log_queue))
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)-8s %(message)s"))
+log_listener = QueueListener(_log_queue, _stream_handler)
+
 # STEP 1: BOT SETUP
 intents: Intents = Intents.default()
 intents.message_content = True  # NOQA
-client: Client = Client(intents=intents)
-tree = app_commands.CommandTree(client)
+# "!" text commands are parsed and dispatched by discord.ext.commands
+client: commands.Bot = commands.Bot(command_prefix='!', intents=intents, help_command=None, case_insensitive=True)
+tree = client.tree
 
 # STEP 2: MESSAGE FUNCTIONALITY
-async def send_message(message: Message, user_message: str, is_mentioned: bool) -> None:
+IMAGE_EXTS = frozenset({'png', 'jpg', 'jpeg'})
+
+def iter_image_attachments(message: Message):
+    """Yields the message's attachments that look like images the model accepts."""
+    for attachment in message.attachments:
+        if attachment.filename.rpartition('.')[2].lower() in IMAGE_EXTS:
+            yield attachment
+
+async def read_attachment(attachment, username: str) -> Tuple[str, bytes]:
+    log.info("Image received from %s: %s", username, attachment.url)
+    # Kept in memory and uploaded straight to the API, no ./downloads round-trip
+    return attachment.filename, await attachment.read()
+
+class ChunkedB64Reader(io.RawIOBase):
+    """Seekable file-like view over a base64 string that decodes only the bytes being read."""
+
+    def __init__(self, b64: str):
+        self._b64 = b64
+        self._size = len(b64) // 4 * 3 - b64[-2:].count("=")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def readinto(self, buf) -> int:
+        end = min(self._pos + len(buf), self._size)
+        if end <= self._pos:
+            return 0
+        # Every 4 base64 chars decode to 3 bytes, so decode the aligned groups only
+        start_group, end_group = self._pos // 3, -(-end // 3)
+        chunk = base64.b64decode(self._b64[start_group * 4:end_group * 4])
+        skip = self._pos - start_group * 3
+        n = end - self._pos
+        buf[:n] = chunk[skip:skip + n]
+        self._pos = end
+        return n
+
+async def stream_response(target, chat_request: ChatRequest) -> Tuple[dict, Optional[Message]]:
+    """Streams the reply into one message, editing it at most every STREAM_EDIT_INTERVAL seconds."""
+    live_message = None
+    buffer = ""
+    last_edit = 0.0
+    response = None
+    async for event in get_response_stream(chat_request):
+        if "delta" not in event:
+            response = event
+            continue
+        buffer += event["delta"]
+        now = time.monotonic()
+        if buffer.strip() and now - last_edit >= STREAM_EDIT_INTERVAL:
+            if live_message is None:
+                live_message = await target.send(buffer[:2000])
+            else:
+                await live_message.edit(content=buffer[:2000])
+            last_edit = now
+    if response is None:
+        # The stream ended without its final event (the server-side turn failed); keep what arrived
+        response = {"response": f"{buffer}\n[Error: the reply was cut off]" if buffer.strip() else "Error: No reply received"}
+    return response, live_message
+
+async def send_message(message: Message, user_message: str, is_mentioned: bool, image_files: list) -> None:
     user_id = str(message.author.id)
     username = str(message.author.display_name)
 
     try:
-        image_paths = []
-        if message.attachments:
-            for attachment in message.attachments:
-                if attachment.filename.lower().endswith(('png', 'jpg', 'jpeg')):
-                    # Use the path where on_message saved it, or save it here if not saved (on_message saves it)
-                    # We assume on_message saved it to ./downloads/filename
-                    # To be safe, let's just use the path logic consistent with on_message
-                    path = f"./downloads/{attachment.filename}"
-                    image_paths.append(path)
-        
         mtext = user_message
-        if image_paths and not user_message:
+        if image_files and not user_message:
              mtext = "What is this image about?"
              
         chat_request = ChatRequest(
             text=mtext, 
-            image_paths=image_paths, 
+            image_files=image_files, 
             user_id=user_id,
             username=username,
             is_mentioned=is_mentioned
         )
-        response: str = get_response(chat_request)
-
         # Handle Response (Always to channel)
         target = message.channel
 
+        if STREAM_RESPONSES:
+            response, live_message = await stream_response(target, chat_request)
+        else:
+            response, live_message = await get_response(chat_request), None
+
+        async def post_text(text: str, file: Optional[File] = None):
+            # Discord caps messages at 2000 chars; the file rides along with the last chunk
+            chunks = [text[i:i + 2000] for i in range(0, len(text), 2000)] or [""]
+            for i, chunk in enumerate(chunks):
+                files = [file] if file and i == len(chunks) - 1 else []
+                if i == 0 and live_message:
+                    # Finish the streamed message instead of sending a new one
+                    await live_message.edit(content=chunk or None, attachments=files)
+                else:
+                    await target.send(content=chunk or None, files=files or None)
+
         if isinstance(response, dict) and "response" in response:
             text_response = response["response"]
             
             if "img" in response and response["img"]:
-                # Decode and send image
-                image_data = base64.b64decode(response['img'])
-                image_bytes = BytesIO(image_data)
-                
-                await target.send(text_response)
-                await target.send(file=File(image_bytes, filename='generated_image.png'))
+                # Image is decoded lazily while discord.py uploads it, in the same message as the text
+                image_file = File(ChunkedB64Reader(response['img']), filename='generated_image.png')
+                await post_text(text_response, image_file)
             else:
-                await target.send(text_response)
+                await post_text(text_response)
         else:
-             await target.send(str(response))
+             await post_text(response if isinstance(response, str) else "Error: No reply received")
             
     except Exception as e:
-        print(e)
+        log.exception("Failed to answer message: %s", e)
 
 
 # STEP 3: HANDLING THE STARTUP FOR OUR BOT
+# Matches the bot's mention tag (<@ID> and nickname form <@!ID>), compiled once the bot's ID is known
+MENTION_RE: Optional[re.Pattern] = None
+BOT_ID: int = 0
+
 @client.event
 async def on_ready() -> None:
+    global MENTION_RE, BOT_ID
+    BOT_ID = client.user.id
+    MENTION_RE = re.compile(rf'<@!?{BOT_ID}>')
     await tree.sync()
-    print(f'{client.user} is now running!')
+    log.info("%s is now running!", client.user)
 
-@tree.command(name="profile", description="Check your Karma and Persona summary")
-async def profile_command(interaction: Interaction):
-    user_id = str(interaction.user.id)
-    username = str(interaction.user.display_name)
-    
-    await interaction.response.defer() # Defer in case API is slow
-    
-    data = get_user_profile_data(user_id)
+async def send_profile(sendable, user) -> None:
+    """Sends the user's karma/persona embed via anything with .send (channel or interaction.followup)."""
+    data = await get_user_profile_data(str(user.id))
     
     if "error" in data:
-        await interaction.followup.send(data["error"])
+        await sendable.send(data["error"])
         return
 
     score = data.get("score", 0)
     summary = data.get("summary", "No summary yet.")
     
-    embed = Embed(title=f"User Profile: {username}", color=Color.gold())
+    embed = Embed(title=f"User Profile: {user.display_name}", color=Color.gold())
     embed.add_field(name="Karma Score", value=str(score), inline=False)
     embed.add_field(name="Persona Summary", value=summary, inline=False)
-    embed.set_thumbnail(url=interaction.user.avatar.url if interaction.user.avatar else None)
+    embed.set_thumbnail(url=user.avatar.url if user.avatar else None)
     
-    await interaction.followup.send(embed=embed)
+    await sendable.send(embed=embed)
+
+@tree.command(name="profile", description="Check your Karma and Persona summary")
+async def profile_command(interaction: Interaction):
+    await interaction.response.defer() # Defer in case API is slow
+    await send_profile(interaction.followup, interaction.user)
 
 
 # STEP 4: HANDLING INCOMING MESSAGES
+# COMMAND: !profile (Get Karma & Persona) - Fallback/Legacy
+@client.command(name="profile")
+async def profile_text_command(ctx: commands.Context) -> None:
+    await send_profile(ctx.channel, ctx.author)
+
 @client.event
 async def on_message(message: Message) -> None:
     # 1. Ignore messages from the bot itself
@@ -112,64 +215,51 @@ async def on_message(message: Message) -> None:
     if message.guild is None:
         return
 
-    # COMMAND: !profile (Get Karma & Persona) - Fallback/Legacy
-    if message.content.strip().lower() == "!profile":
-        user_id = str(message.author.id)
-        username = str(message.author.display_name)
-        
-        data = get_user_profile_data(user_id)
-        
-        if "error" in data:
-            await message.channel.send(data["error"])
+    # Only messages starting with "!" can be commands; everything else skips the parser
+    if message.content.startswith('!'):
+        ctx = await client.get_context(message)
+        if ctx.valid:
+            await client.invoke(ctx)
             return
 
-        score = data.get("score", 0)
-        summary = data.get("summary", "No summary yet.")
-        
-        embed = Embed(title=f"User Profile: {username}", color=Color.gold())
-        embed.add_field(name="Karma Score", value=str(score), inline=False)
-        embed.add_field(name="Persona Summary", value=summary, inline=False)
-        embed.set_thumbnail(url=message.author.avatar.url if message.author.avatar else None)
-        
-        await message.channel.send(embed=embed)
-        return
-
     # 3. Check if Bot is Mentioned or Replied to
-    is_mentioned = client.user in message.mentions
-    is_reply = (message.reference is not None and message.reference.resolved and message.reference.resolved.author == client.user)
+    # Plain int comparisons; resolved may be a DeletedReferencedMessage without an author
+    is_mentioned = BOT_ID in message.raw_mentions
+    ref = message.reference
+    resolved_author = getattr(ref.resolved, 'author', None) if ref is not None else None
+    is_reply = resolved_author is not None and resolved_author.id == BOT_ID
     
     # "is_mentioned" flag for the model (True if tagged OR replied to)
     is_targeted = is_mentioned or is_reply
 
+    # Untagged chatter never reaches the model unless passive replies are on
+    if not is_targeted and not PASSIVE_REPLIES:
+        return
+
     username: str = str(message.author)
     user_message: str = message.content
     channel: str = str(message.channel)
 
-    print(f'[{channel}] {username}: "{user_message}" (Tagged: {is_targeted})')
+    log.info('[%s] %s: "%s" (Tagged: %s)', channel, username, user_message, is_targeted)
 
     # 4. Clean the Message: Remove the bot's mention tag <@ID> if present
     if is_mentioned:
-        # Remove the mention string (e.g. <@123456789>)
-        user_message = user_message.replace(f'<@{client.user.id}>', '').strip()
-        # Also handle nickname mentions <@!ID>
-        user_message = user_message.replace(f'<@!{client.user.id}>', '').strip()
+        # Remove the mention strings (<@ID> and nickname form <@!ID>) in one pass
+        user_message = MENTION_RE.sub('', user_message).strip()
 
     # Check if the message contains attachments
-    if message.attachments:
-        for attachment in message.attachments:
-            if attachment.filename.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'bmp')):
-                print(f"Image received from {username}: {attachment.url}")
-                # Create the downloads directory if it doesn't exist
-                os.makedirs("./downloads", exist_ok=True)
-                # You can download the image if needed
-                await attachment.save(f"./downloads/{attachment.filename}")
-                print(f"Image saved as ./downloads/{attachment.filename}")
+    # Download all images concurrently
+    image_files = list(await asyncio.gather(*(read_attachment(a, username) for a in iter_image_attachments(message))))
                 
-    await send_message(message, user_message, is_targeted)
+    await send_message(message, user_message, is_targeted, image_files)
 
 # STEP 5: MAIN ENTRY POINT
 def main() -> None:
-    client.run(token=TOKEN)
+    log_listener.start()
+    try:
+        client.run(token=TOKEN)
+    finally:
+        log_listener.stop()
 
 
 if __name__ == '__main__':
@@ -1,26 +1,42 @@
 import os
 import base64
+from typing import Union
 from google import genai
 from google.genai import types
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Using the specific model requested by user
+IMAGE_MODEL = "gemini-3-pro-image-preview"
+
+# Created once and reused, so image requests share its connection pool
+_client = None
+
 def _get_client():
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        print("GOOGLE_API_KEY not found.")
-        return None
-    return genai.Client(api_key=api_key)
+    global _client
+    if _client is None:
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("GOOGLE_API_KEY not found.")
+            return None
+        _client = genai.Client(api_key=api_key)
+    return _client
+
+def prewarm():
+    """Builds the client and opens its connection, so the first image request skips the handshake."""
+    try:
+        client = _get_client()
+        if client:
+            client.models.get(model=IMAGE_MODEL)
+    except Exception:
+        pass  # Warm-up only; the real request reports its own errors
 
 def _generate_content(contents, prompt_desc):
     client = _get_client()
     if not client: 
         return None
 
-    # Using the specific model requested by user
-    model = "gemini-3-pro-image-preview"
-
     # Configure for Image generation
     generate_content_config = types.GenerateContentConfig(
         response_modalities=[
@@ -44,10 +60,10 @@ def _generate_content(contents, prompt_desc):
     print(f"Processing image request: {prompt_desc}")
     
     try:
-        generated_image_b64 = None
+        generated_image = None
         
         for chunk in client.models.generate_content_stream(
-            model=model,
+            model=IMAGE_MODEL,
             contents=contents,
             config=generate_content_config,
         ):
@@ -61,15 +77,15 @@ def _generate_content(contents, prompt_desc):
             
             for part in chunk.candidates[0].content.parts:
                 if part.inline_data and part.inline_data.data:
-                    image_bytes = part.inline_data.data
-                    generated_image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+                    generated_image = part.inline_data.data
                     break
             
-            if generated_image_b64:
+            if generated_image:
                 break
 
-        if generated_image_b64:
-            return {"images": [generated_image_b64]}
+        # Raw bytes; callers base64-encode only where a string is actually needed
+        if generated_image:
+            return {"images": [generated_image]}
         else:
             print("No image data found in response.")
             return None
@@ -92,16 +108,17 @@ def generate_image(prompt: str, **kwargs):
     ]
     return _generate_content(contents, f"Generate: {prompt}")
 
-def edit_image(base64_images: list[str], prompt: str, **kwargs):
+def edit_image(images: list[Union[str, bytes]], prompt: str, **kwargs):
     """
     Edits existing image(s) based on text prompt.
+    Images may be raw bytes or base64 strings; only strings are decoded.
     """
     parts = [types.Part.from_text(text=prompt)]
     
-    for b64 in base64_images:
+    for image in images:
         parts.append(
             types.Part.from_bytes(
-                data=base64.b64decode(b64), 
+                data=base64.b64decode(image) if isinstance(image, str) else image, 
                 mime_type="image/jpeg"
             )
         )
@@ -1,15 +1,29 @@
 import os
-import base64
+try:
+    import pybase64 as base64  # SIMD codec, drop-in for the stdlib module
+except ImportError:
+    import base64
 import hashlib
 import time
-import json
 import re
+import logging
+import atexit
+import pickle
+import shutil
 import uuid
 import datetime
-from collections import deque
-from typing import List, Optional, Dict, Any, Tuple
+import threading
+from collections import deque, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import quote, unquote
+from typing import List, Optional, Dict, Any, Tuple, Iterator
 
 import chromadb
+import httpx
+import numpy as np
+import orjson
+from PIL import Image, ImageOps
 from openai import OpenAI
 from google import genai
 from google.genai import types
@@ -25,19 +39,63 @@ from config import (
     COLLECTION_NAME,
     CHROMA_DB_PATH,
     HISTORY_MAXLEN,
+    HISTORY_COMPACT_LINES,
+    KARMA_FLUSH_DELAY,
+    RAG_CACHE_SIZE,
+    RAG_CACHE_SIMILARITY,
+    LOCAL_SEARCH_MAX_MEMORIES,
     CONTEXT_LENGTH_IMAGE,
     CONTEXT_LENGTH_TEXT,
     MAX_USER_INPUT_IMAGES,
     MAX_TOKENS_MEMORY,
     MAX_TOKENS_SUMMARY,
-    MAX_TOKENS_RESPONSE
+    MAX_TOKENS_RESPONSE,
+    BATCH_MAX_SIZE,
+    PROMPT_WARMUP,
+    LLM_MAX_CONNECTIONS,
+    MAX_IMAGE_SIDE
 )
-from src.gemini_vision import generate_image, edit_image
+from src.gemini_vision import generate_image, edit_image, prewarm as prewarm_vision
 
 # Initialize colorama
 init(autoreset=True)
 load_dotenv()
 
+# log() goes through logging; values passed as args are only formatted when the message is emitted
+logger = logging.getLogger("ananbot.multimodal")
+
+class _SectionFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return f"{record.color}[{record.section}]{Style.RESET_ALL} {record.getMessage()}"
+
+_handler = logging.StreamHandler()
+_handler.setFormatter(_SectionFormatter())
+logger.addHandler(_handler)
+logger.propagate = False
+
+# Static system message, built once and shared by every request (never mutated)
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Control tags appended by the model (see SYSTEM_PROMPT), compiled once
+KARMA_TAG_RE = re.compile(r"\{karma([+-])\}")
+ACTION_TAG_RE = re.compile(r"\{(gen|edit)\}\s*(.+)", re.IGNORECASE | re.DOTALL)
+# Hallucinated karma artifacts: ($?NUMBER$ Karma) or (Karma: NUMBER)
+KARMA_ARTIFACT_RE = re.compile(r'\(?-?\d+\$?\s*Karma\)?|\(?Karma:\s*-?\d+\)?', re.IGNORECASE)
+# Extracted memories: "{qa} question {answer} answer" records (see MEMORY_PROMPT)
+MEMORY_RE = re.compile(r"\{qa\}((?:(?!\{qa\}).)*?)\{answer\}(.*?)(?=\{qa\}|\Z)", re.DOTALL)
+
+# Number of base64-encoded images kept in memory (keyed by content hash)
+B64_CACHE_SIZE = 32
+# Images are base64-encoded/decoded in slices of this many raw bytes (multiple of 3, so slices align)
+B64_CHUNK = 57 * 1024
+B64_CHUNK_CHARS = B64_CHUNK // 3 * 4
+# Number of text embeddings kept in memory (keyed by normalized text)
+EMBED_CACHE_SIZE = 4096
+# HNSW settings for a newly created memory collection. Space stays L2 so THRESHOLD keeps
+# its meaning; search_ef is raised from the default 10 for better recall on short documents.
+MEMORY_HNSW = {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 64}
+USER_MEMORY_CACHE_USERS = 64  # Users whose memory matrices are kept for local search
+
 SUMMARY_PROMPT = '''
 You are an expert profiler. Update the user's persona summary based on the new interaction.
 Existing Summary: {current_summary}
@@ -54,6 +112,59 @@ Keep it to a concise paragraph (max 100 words).
 Return ONLY the updated summary text.
 '''
 
+def _quantize(embedding: List[float]) -> Tuple[float, bytes]:
+    """Packs an embedding as int8 with a per-vector scale (1 byte per dimension)."""
+    vec = np.asarray(embedding, dtype=np.float32)
+    scale = float(np.abs(vec).max()) / 127 or 1.0
+    return scale, np.round(vec / scale).astype(np.int8).tobytes()
+
+def _dequantize(packed: Tuple[float, bytes]) -> List[float]:
+    scale, data = packed
+    return (np.frombuffer(data, dtype=np.int8).astype(np.float32) * scale).tolist()
+
+class SemanticCache:
+    """Fixed-size ring of (user, unit embedding) -> value; get() returns the value of a near-duplicate query."""
+
+    def __init__(self, size: int, threshold: float, dim: int = 768):
+        self.threshold = threshold
+        self._keys = np.zeros((size, dim), dtype=np.float32)
+        self._users: List[Optional[str]] = [None] * size
+        self._values: List[Any] = [None] * size
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+    def get(self, user_id: str, embedding: List[float]) -> Optional[Any]:
+        q = self._unit(embedding)
+        with self._lock:
+            # One matrix-vector product scores every slot; other users' slots are masked out
+            sims = self._keys @ q
+            mask = np.fromiter((u == user_id for u in self._users), dtype=bool, count=len(self._users))
+            if not mask.any():
+                return None
+            sims[~mask] = -1.0
+            best = int(np.argmax(sims))
+            return self._values[best] if sims[best] >= self.threshold else None
+
+    def put(self, user_id: str, embedding: List[float], value: Any):
+        with self._lock:
+            i = self._next
+            self._keys[i] = self._unit(embedding)
+            self._users[i] = user_id
+            self._values[i] = value
+            self._next = (i + 1) % len(self._values)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            for i, u in enumerate(self._users):
+                if u == user_id:
+                    self._users[i] = None
+                    self._values[i] = None
+
 class Multimodal:
     def __init__(self, debug: bool = False):
         """
@@ -62,13 +173,23 @@ class Multimodal:
             debug (bool): If True, prints verbose debug information.
         """
         self.debug = debug
+        # Errors are always shown; everything else only in debug mode
+        logger.setLevel(logging.DEBUG if debug else logging.ERROR)
         # OpenAI Client for Gemini
         self.api_key = os.getenv("GOOGLE_API_KEY")
         self.model_name = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
         
+        # Shared HTTP/2 keep-alive pool so concurrent turns multiplex over warm connections
+        self.http_client = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            # Idle connections are kept for 30s (default 5s), so a chat pause doesn't cost a new TLS handshake
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS, keepalive_expiry=30.0)
+        )
         self.client = OpenAI(
             api_key=self.api_key,
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
+            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+            http_client=self.http_client
         )
         
         # Google GenAI Client for Embeddings
@@ -76,31 +197,112 @@ class Multimodal:
 
         # ChromaDB for Long-term Memory (RAG)
         self.chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        self.collection = self.chroma_client.get_or_create_collection(name=COLLECTION_NAME)
+        try:
+            self.collection = self.chroma_client.get_collection(name=COLLECTION_NAME)
+        except Exception:  # Not found; HNSW settings can only be chosen at creation
+            self.collection = self.chroma_client.create_collection(name=COLLECTION_NAME, metadata=MEMORY_HNSW)
+        # Every stored memory id, so de-duplication never has to ask Chroma
+        self._memory_ids = set(self.collection.get(include=[])['ids'])
 
         # Persistence Paths
-        self.karma_file = "./memories/karma.json"
-        self.history_file = "./memories/chat_history.json"
+        self.karma_file = "./memories/karma.json"  # Legacy single-file store, imported once
+        self.karma_dir = "./memories/karma"  # One JSON shard per user
+        self.history_file = "./memories/chat_history.jsonl"
+        self.legacy_history_file = "./memories/chat_history.json"
         self.image_dir = "./memories/images"
+        self.embed_cache_file = "./memories/embed_cache.pkl"
         os.makedirs(self.image_dir, exist_ok=True)
         
+        # Image files are written off the request path by a single background thread
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-io")
+        self._pending_writes = {}
+
         # Load Data
-        self.karma_db = self._load_json(self.karma_file)
+        self._karma_lock = threading.Lock()
+        self._karma_timer = None
+        self._karma_dirty = set()
+        atexit.register(self._flush_karma)
+        self.karma_db = self._load_karma()
         self.histories = {}
         self.usernames = {}
-        self.last_images = {} # Stores LIST of image PATHS per user
+        self.last_images = {} # Stores deque of the last image PATHS per user
         self._load_history()
 
-    def log(self, section: str, message: str, color=Fore.WHITE):
-        """Helper to print debug messages."""
-        if self.debug:
-            print(f"{color}[{section.upper()}]{Style.RESET_ALL} {message}")
+        if PROMPT_WARMUP:
+            threading.Thread(target=self._warmup, daemon=True).start()
+        threading.Thread(target=self._prewarm_connections, daemon=True).start()
+
+        # Worker pool for batched generation (see generate_response_batch)
+        self._batch_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_SIZE)
+        self._user_locks = defaultdict(threading.Lock)
+        # RAG lookups (embedding + Chroma query) overlap with prompt assembly
+        self._rag_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_SIZE)
+        # Memory extraction and summary completions of a batch; also caps how many run at once
+        self._memory_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_SIZE)
+
+        # LRU of image content hash or (path, mtime_ns) -> base64 string
+        self._b64_cache = OrderedDict()
+        self._b64_lock = threading.Lock()
+
+        # LRU of user_id -> (int8 embeddings, row scales, squared norms, ids, documents, metadatas), or None when
+        # the user has too many memories and is searched through Chroma instead
+        self._user_memories = OrderedDict()
+        self._user_memories_lock = threading.Lock()
+        # user_id -> count of memory stores; a cache fill that saw it change mid-fetch is dropped as stale.
+        # Guarded by _user_memories_lock, which also covers _rag_cache puts and invalidations.
+        self._memory_generation = defaultdict(int)
+
+        # Recent (user, query embedding) -> retrieved context, for near-duplicate queries
+        self._rag_cache = SemanticCache(RAG_CACHE_SIZE, RAG_CACHE_SIMILARITY)
+
+        # LRU of normalized text -> embedding, persisted across restarts
+        self._embed_cache = self._load_embed_cache()
+        self._embed_lock = threading.Lock()
+        atexit.register(self.save_embed_cache)
+
+    def _warmup(self):
+        """Sends the static system prompt once so the backend's prefix cache is primed."""
+        try:
+            self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[
+                    SYSTEM_MESSAGE,
+                    {"role": "user", "content": "hi"}
+                ],
+                max_tokens=1
+            )
+            self.log("SYSTEM", "Prompt cache warm-up done.", Fore.CYAN)
+        except Exception as e:
+            self.log("WARNING", f"Prompt cache warm-up failed: {e}", Fore.YELLOW)
+
+    def _prewarm_connections(self):
+        """Opens the embedding and image-model connections so the first turn skips their TLS handshakes."""
+        if not PROMPT_WARMUP:  # Otherwise _warmup already opens the chat connection
+            try:
+                self.client.models.list()
+            except Exception:
+                pass
+        try:
+            self.genai_client.models.get(model="text-embedding-004")
+        except Exception:
+            pass
+        prewarm_vision()
+
+    def log(self, section: str, message: str, color=Fore.WHITE, *args):
+        """
+        Helper to log debug messages (ERROR sections are logged at error level).
+        Extra args are %-formatted into message only if the record is emitted, so per-turn
+        dumps pass them separately instead of building an f-string that debug=False would discard.
+        """
+        level = logging.ERROR if section.upper() == "ERROR" else logging.DEBUG
+        if logger.isEnabledFor(level):
+            logger.log(level, message, *args, extra={"section": section.upper(), "color": color})
 
     def _load_json(self, filepath: str) -> Dict:
         if os.path.exists(filepath):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(filepath, 'rb') as f:
+                    return orjson.loads(f.read())
             except Exception as e:
                 self.log("ERROR", f"Failed to load {filepath}: {e}", Fore.RED)
                 return {}
@@ -108,39 +310,117 @@ class Multimodal:
 
     def _save_json(self, filepath: str, data: Dict):
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # orjson writes UTF-8 bytes directly; same 2-space layout as the old json.dump output
+            with open(filepath, 'wb') as f:
+                f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         except Exception as e:
             self.log("ERROR", f"Failed to save {filepath}: {e}", Fore.RED)
 
     def _save_image_to_disk(self, b64_data: str) -> str:
-        """Saves base64 image data to disk and returns the relative path."""
+        """Queues base64 image data to be decoded into a new file and returns its relative path."""
+        return self._queue_image_write(self._write_b64_file, b64_data)
+
+    def _save_image_bytes_to_disk(self, data: bytes) -> str:
+        """Queues raw image bytes to be written to a new file and returns its relative path."""
+        return self._queue_image_write(self._write_bytes_file, data)
+
+    def _queue_image_write(self, writer, payload) -> str:
+        # The path is known up front, so the turn continues while the image-io thread writes;
+        # _load_image_from_disk waits on the pending write if it needs the file first.
+        path = os.path.join(self.image_dir, f"{uuid.uuid4()}.png")
+        future = self._io_pool.submit(writer, path, payload)
+        self._pending_writes[path] = future
+        future.add_done_callback(lambda _: self._pending_writes.pop(path, None))
+        return path
+
+    def _write_b64_file(self, path: str, b64_data: str):
         try:
-            image_id = str(uuid.uuid4())
-            filename = f"{image_id}.png"
-            path = os.path.join(self.image_dir, filename)
-            
             with open(path, "wb") as f:
-                f.write(base64.b64decode(b64_data))
-            
-            return path
+                # Decoded slice by slice so the raw image is never held in memory whole
+                for i in range(0, len(b64_data), B64_CHUNK_CHARS):
+                    f.write(base64.b64decode(b64_data[i:i + B64_CHUNK_CHARS]))
+        except Exception as e:
+            self.log("ERROR", f"Failed to save image to disk: {e}", Fore.RED)
+
+    def _write_bytes_file(self, path: str, data: bytes):
+        try:
+            with open(path, "wb") as f:
+                f.write(data)
         except Exception as e:
             self.log("ERROR", f"Failed to save image to disk: {e}", Fore.RED)
-            return ""
 
     def _load_image_from_disk(self, path: str) -> Optional[str]:
         """Loads image from disk and returns base64 string."""
-        if not path or not os.path.exists(path):
+        if not path:
             return None
+        pending = self._pending_writes.get(path)
+        if pending:
+            pending.result()
         try:
+            # History images are re-sent every turn; (path, mtime) hits skip the read entirely
+            # and a rewritten file gets a new key
+            path_key = (path, os.stat(path).st_mtime_ns)
+            b64 = self._b64_cache_get(path_key)
+            if b64 is not None:
+                return b64
+
+            # Hash and encode slice by slice, so the raw file is never held in memory whole
+            hasher = hashlib.blake2b(digest_size=16)
+            encoded = bytearray()
             with open(path, "rb") as f:
-                return base64.b64encode(f.read()).decode('utf-8')
+                while chunk := f.read(B64_CHUNK):
+                    hasher.update(chunk)
+                    encoded += base64.b64encode(chunk)
+            key = hasher.digest()
+            b64 = self._b64_cache_get(key)
+            if b64 is None:
+                b64 = encoded.decode('ascii')
+                self._b64_cache_put(key, b64)
+            self._b64_cache_put(path_key, b64)  # Same str object, no extra copy
+            return b64
+        except FileNotFoundError:
+            return None
         except Exception as e:
             self.log("ERROR", f"Failed to load image from disk: {e}", Fore.RED)
             return None
 
     def _load_history(self):
-        raw_data = self._load_json(self.history_file)
+        # Append-only log: replaying it is bounded by HISTORY_MAXLEN per user, whatever the file size
+        self._history_lock = threading.Lock()
+        self._history_pending = []
+        self._history_lines = 0
+        if os.path.exists(self.history_file):
+            self._replay_history()
+        else:
+            self._load_legacy_history()
+            self._compact_history()
+        self._history_fp = open(self.history_file, 'ab')
+
+    def _replay_history(self):
+        count = 0
+        try:
+            with open(self.history_file, 'rb') as f:
+                for line in f:
+                    try:
+                        record = orjson.loads(line)
+                    except orjson.JSONDecodeError:  # Torn last line after a crash
+                        continue
+                    self._history_lines += 1
+                    user_id = record["user"]
+                    if "username" in record:
+                        self.usernames[user_id] = record["username"]
+                    if "messages" in record:
+                        self.get_user_history(user_id).extend(record["messages"])
+                        count += len(record["messages"])
+                    if "last_image" in record:
+                        self.last_images[user_id] = deque(record["last_image"], maxlen=CONTEXT_LENGTH_IMAGE)
+        except Exception as e:
+            self.log("ERROR", f"Failed to load {self.history_file}: {e}", Fore.RED)
+
+        self.log("SYSTEM", f"Replayed {count} messages for {len(self.histories)} users.", Fore.CYAN)
+
+    def _load_legacy_history(self):
+        raw_data = self._load_json(self.legacy_history_file)
         count = 0
         
         for user_id, entry in raw_data.items():
@@ -157,44 +437,141 @@ class Multimodal:
                 if "last_image" in entry:
                     img_data = entry["last_image"]
                     if isinstance(img_data, list):
-                        self.last_images[user_id] = img_data
+                        self.last_images[user_id] = deque(img_data, maxlen=CONTEXT_LENGTH_IMAGE)
                     elif isinstance(img_data, str): # Legacy single
-                         self.last_images[user_id] = [img_data]
+                         self.last_images[user_id] = deque([img_data], maxlen=CONTEXT_LENGTH_IMAGE)
 
                 count += len(msgs)
+
+        for msgs in self.histories.values():
+            self._externalize_inline_images(msgs)
                 
         self.log("SYSTEM", f"Loaded {count} messages for {len(self.histories)} users.", Fore.CYAN)
 
+    def _externalize_inline_images(self, msgs):
+        """Moves legacy inline data: URLs out to ./memories/images so history only ever holds paths."""
+        for msg in msgs:
+            if not isinstance(msg.get("content"), list):
+                continue
+            for part in msg["content"]:
+                if part.get("type") != "image_url":
+                    continue
+                url = part["image_url"]["url"]
+                if url.startswith("data:"):
+                    path = self._save_image_to_disk(url.split(",", 1)[1])
+                    if path:
+                        part["image_url"]["url"] = path
+
     def _save_history(self):
-        serializable_data = {}
-        for user_id, msgs in self.histories.items():
-            serializable_data[user_id] = {
-                "username": self.usernames.get(user_id, "Unknown"),
-                "messages": list(msgs),
-                "last_image": self.last_images.get(user_id, [])
-            }
-        self._save_json(self.history_file, serializable_data)
+        """Appends the history records queued since the last save (O(new turns), not O(all history))."""
+        with self._history_lock:
+            pending, self._history_pending = self._history_pending, []
+            if not pending:
+                return
+            try:
+                self._history_fp.write(b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE) for r in pending))
+                self._history_fp.flush()
+            except Exception as e:
+                self.log("ERROR", f"Failed to save {self.history_file}: {e}", Fore.RED)
+                return
+            self._history_lines += len(pending)
+            if self._history_lines >= HISTORY_COMPACT_LINES + len(self.histories):
+                self._compact_history()
+
+    def _compact_history(self):
+        """Rewrites the log as one snapshot record per user. Caller holds _history_lock (or is __init__)."""
+        tmp_path = self.history_file + ".tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                # Snapshot: get_user_history adds first-time users without taking _history_lock
+                for user_id, msgs in list(self.histories.items()):
+                    record = {
+                        "user": user_id,
+                        "username": self.usernames.get(user_id, "Unknown"),
+                        "messages": list(msgs),
+                        "last_image": list(self.last_images.get(user_id, ()))
+                    }
+                    f.write(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE))
+            if getattr(self, "_history_fp", None):
+                self._history_fp.close()
+            os.replace(tmp_path, self.history_file)
+            if getattr(self, "_history_fp", None):
+                self._history_fp = open(self.history_file, 'ab')
+            # The snapshot already contains anything still queued
+            self._history_pending = []
+            self._history_lines = len(self.histories)
+        except Exception as e:
+            self.log("ERROR", f"Failed to compact {self.history_file}: {e}", Fore.RED)
 
     def _update_last_images(self, user_id: str, image_path: str):
-        if user_id not in self.last_images:
-            self.last_images[user_id] = []
-        
-        # Append new image path
-        self.last_images[user_id].append(image_path)
-        
-        # Keep only the last N images (CONTEXT_LENGTH_IMAGE = 2)
-        if len(self.last_images[user_id]) > CONTEXT_LENGTH_IMAGE:
-            # We could delete the file from disk here if we wanted to save space,
-            # but for history purposes we keep the file.
-            self.last_images[user_id] = self.last_images[user_id][-CONTEXT_LENGTH_IMAGE:]
+        # Bounded deque: keeps only the last CONTEXT_LENGTH_IMAGE paths, no re-slicing.
+        # Older files stay on disk for history purposes.
+        with self._history_lock:
+            last = self.last_images.setdefault(user_id, deque(maxlen=CONTEXT_LENGTH_IMAGE))
+            last.append(image_path)
+            self._history_pending.append({"user": user_id, "last_image": list(last)})
 
     def get_karma_info(self, user_id: str) -> Dict[str, Any]:
-        entry = self.karma_db.get(user_id)
-        if isinstance(entry, int):
-            return {"score": entry, "username": "Unknown"}
-        elif isinstance(entry, dict):
-            return entry
-        return {"score": 0, "username": "Unknown"}
+        # Legacy int entries are normalized at load time
+        return self.karma_db.get(user_id) or {"score": 0, "username": "Unknown"}
+
+    def _karma_shard(self, user_id: str) -> str:
+        # Quoted so arbitrary user ids can't escape karma_dir
+        return os.path.join(self.karma_dir, quote(user_id, safe="") + ".json")
+
+    def _load_karma(self) -> Dict[str, Dict[str, Any]]:
+        """Rolls all per-user shards up into memory; on first run, imports the legacy karma.json."""
+        karma_db = {}
+        if os.path.isdir(self.karma_dir):
+            for entry in os.scandir(self.karma_dir):
+                if entry.name.endswith(".json"):
+                    karma_db[unquote(entry.name[:-len(".json")])] = self._load_json(entry.path)
+            return karma_db
+
+        for user_id, entry in self._load_json(self.karma_file).items():
+            if isinstance(entry, int): # Legacy: bare score
+                entry = {"score": entry, "username": "Unknown"}
+            karma_db[user_id] = entry
+
+        # Shards are written to a temp dir that only becomes karma_dir once complete, so a crash
+        # mid-migration leaves karma.json as the source of truth for the next start
+        tmp_dir = self.karma_dir + ".tmp"
+        try:
+            shutil.rmtree(tmp_dir, ignore_errors=True)  # Leftover of an interrupted migration
+            os.makedirs(tmp_dir)
+            for user_id, entry in karma_db.items():
+                with open(os.path.join(tmp_dir, quote(user_id, safe="") + ".json"), 'wb') as f:
+                    f.write(orjson.dumps(entry, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+            os.replace(tmp_dir, self.karma_dir)
+        except OSError as e:
+            self.log("ERROR", f"Failed to migrate {self.karma_file} to {self.karma_dir}: {e}", Fore.RED)
+        return karma_db
+
+    def _mark_karma_dirty(self, user_id: str):
+        """Schedules this user's shard write KARMA_FLUSH_DELAY from now; later changes ride along."""
+        with self._karma_lock:
+            self._karma_dirty.add(user_id)
+            if self._karma_timer is None:
+                self._karma_timer = threading.Timer(KARMA_FLUSH_DELAY, self._flush_karma)
+                self._karma_timer.daemon = True
+                self._karma_timer.start()
+
+    def _flush_karma(self):
+        with self._karma_lock:
+            if self._karma_timer is None:
+                return
+            self._karma_timer.cancel()
+            self._karma_timer = None
+            dirty, self._karma_dirty = self._karma_dirty, set()
+            # Only changed users are rewritten (~100 bytes each), atomically via tmp + rename.
+            # Entries are copied so concurrent updates can't mutate them mid-dump.
+            for user_id in dirty:
+                path = self._karma_shard(user_id)
+                self._save_json(path + ".tmp", dict(self.karma_db[user_id]))
+                try:
+                    os.replace(path + ".tmp", path)
+                except OSError as e:
+                    self.log("ERROR", f"Failed to save {path}: {e}", Fore.RED)
 
     def get_karma(self, user_id: str) -> int:
         return self.get_karma_info(user_id).get("score", 0)
@@ -204,6 +581,8 @@ class Multimodal:
         current_score = current_info.get("score", 0)
         
         new_score = current_score + change
+        if user_id in self.karma_db and change == 0 and (not username or username == current_info.get("username")):
+            return new_score  # Nothing changed, nothing to write
         
         # Update score and username, preserve other fields (like summary)
         current_info["score"] = new_score
@@ -212,8 +591,8 @@ class Multimodal:
             
         self.karma_db[user_id] = current_info
         
-        self._save_json(self.karma_file, self.karma_db)
-        self.log("KARMA", f"User {user_id} ({username}) karma updated: {current_score} -> {new_score}", Fore.YELLOW)
+        self._mark_karma_dirty(user_id)
+        self.log("KARMA", "User %s (%s) karma updated: %s -> %s", Fore.YELLOW, user_id, username, current_score, new_score)
         return new_score
 
     def get_user_history(self, user_id: str) -> deque:
@@ -221,110 +600,268 @@ class Multimodal:
             self.histories[user_id] = deque(maxlen=HISTORY_MAXLEN)
         return self.histories[user_id]
 
-    def generate_memory_id(self, content: str) -> str:
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+    def generate_memory_id(self, *parts: str) -> str:
+        # Parts are hashed back to back, same as hashing their concatenation
+        h = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            h.update(part.encode('utf-8'))
+        return h.hexdigest()
+
+    def _legacy_memory_id(self, *parts: str) -> str:
+        # Id scheme of memories stored before BLAKE2b; checked too so they aren't stored again
+        return hashlib.md5("".join(parts).encode('utf-8')).hexdigest()
+
+    def _load_embed_cache(self) -> OrderedDict:
+        if os.path.exists(self.embed_cache_file):
+            try:
+                with open(self.embed_cache_file, 'rb') as f:
+                    items = pickle.load(f)
+                # Skip entries from older cache formats (plain float tuples)
+                return OrderedDict(
+                    (k, v) for k, v in items
+                    if isinstance(v, tuple) and len(v) == 2 and isinstance(v[1], bytes)
+                )
+            except Exception as e:
+                self.log("ERROR", f"Failed to load {self.embed_cache_file}: {e}", Fore.RED)
+        return OrderedDict()
+
+    def save_embed_cache(self):
+        """Writes the embedding cache to disk (called at exit)."""
+        try:
+            with self._embed_lock:
+                items = list(self._embed_cache.items())
+            with open(self.embed_cache_file, 'wb') as f:
+                pickle.dump(items, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.log("ERROR", f"Failed to save {self.embed_cache_file}: {e}", Fore.RED)
 
     def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embeds several texts; cache misses go out in one embed_content call. Failures come back as []."""
+        keys = [re.sub(r"\s+", " ", text.strip().lower()) for text in texts]
+        embeddings = [None] * len(keys)
+        with self._embed_lock:
+            for i, key in enumerate(keys):
+                cached = self._embed_cache.get(key)
+                if cached is not None:
+                    self._embed_cache.move_to_end(key)
+                    embeddings[i] = _dequantize(cached)
+
+        # Normalized text is only the cache key; each missing key is embedded from the first original text behind it
+        missing = {}
+        for key, text, emb in zip(keys, texts, embeddings):
+            if emb is None:
+                missing.setdefault(key, text)
+        if not missing:
+            return embeddings
+
         try:
             result = self.genai_client.models.embed_content(
                 model="text-embedding-004",
-                contents=text,
+                contents=list(missing.values()),
                 config=types.EmbedContentConfig(output_dimensionality=768)
             )
-            return result.embeddings[0].values
+            fetched = {key: list(e.values) for key, e in zip(missing, result.embeddings)}
         except Exception as e:
             self.log("ERROR", f"Embedding error: {e}", Fore.RED)
-            return []
+            fetched = {}
+
+        with self._embed_lock:
+            for key, embedding in fetched.items():
+                # Stored as int8 + scale: ~32x smaller than a tuple of Python floats
+                self._embed_cache[key] = _quantize(embedding)
+                if len(self._embed_cache) > EMBED_CACHE_SIZE:
+                    self._embed_cache.popitem(last=False)
+        return [emb if emb is not None else fetched.get(key, []) for key, emb in zip(keys, embeddings)]
+
+    def _to_base64(self, data: bytes) -> str:
+        """Base64-encodes image bytes, reusing the cached string for content seen recently."""
+        key = hashlib.blake2b(data, digest_size=16).digest()
+        b64 = self._b64_cache_get(key)
+        if b64 is None:
+            b64 = base64.b64encode(data).decode('utf-8')
+            self._b64_cache_put(key, b64)
+        return b64
+
+    def _b64_cache_get(self, key) -> Optional[str]:
+        with self._b64_lock:
+            b64 = self._b64_cache.get(key)
+            if b64 is not None:
+                self._b64_cache.move_to_end(key)
+            return b64
+
+    def _b64_cache_put(self, key, b64: str):
+        # Reusing one str per content keeps repeated images from piling up as duplicate strings
+        with self._b64_lock:
+            self._b64_cache[key] = b64
+            if len(self._b64_cache) > B64_CACHE_SIZE:
+                self._b64_cache.popitem(last=False)
+
+    def _shrink_image(self, data: bytes) -> bytes:
+        """
+        Downscales images larger than MAX_IMAGE_SIDE before they are sent to the model.
+        Re-encodes as JPEG, which is the MIME type the API is told it receives.
+        """
+        try:
+            with Image.open(BytesIO(data)) as image:  # Only the header is parsed here
+                if max(image.size) <= MAX_IMAGE_SIDE:
+                    return data
+                # JPEGs decode straight at a reduced DCT scale (never below the target size)
+                image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+                # The re-encode drops EXIF, so apply its orientation to the pixels first
+                image = ImageOps.exif_transpose(image)
+                image = image.convert("RGB")
+                image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.BILINEAR)
+                buf = BytesIO()
+                image.save(buf, format="JPEG", quality=85)
+                return buf.getvalue()
+        except Exception as e:
+            self.log("ERROR", f"Failed to shrink image: {e}", Fore.RED)
+            return data
 
-    def _encode_image(self, image_path: str) -> str:
+    def _read_image(self, image_path: str) -> bytes:
         with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+            return image_file.read()
+
+    def _load_image_bytes(self, path: str) -> Optional[bytes]:
+        """Reads a saved image as raw bytes, waiting for its write if still queued."""
+        pending = self._pending_writes.get(path)
+        if pending:
+            pending.result()
+        try:
+            return self._read_image(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.log("ERROR", f"Failed to load image from disk: {e}", Fore.RED)
+            return None
 
     def retrieve_context(self, query: str, user_id: str) -> str:
-        self.log("RAG", f"Querying memory for: '{query}'", Fore.CYAN)
+        self.log("RAG", "Querying memory for: '%s'", Fore.CYAN, query)
         embedding = self.get_embedding(query)
         if not embedding:
             return ""
 
-        results = self.collection.query(
-            query_embeddings=[embedding],
-            n_results=MEMORY_RECALL_COUNT,
-            where={"user_id": user_id} 
-        )
+        cached = self._rag_cache.get(user_id, embedding)
+        if cached is not None:
+            self.log("RAG", "Reusing context of a near-identical recent query.", Fore.CYAN)
+            return cached
 
-        context_str = ""
-        found_memories = []
-        retrieved_docs_debug = []
-        
-        if results['documents']:
-            for i, doc in enumerate(results['documents'][0]):
-                dist = results['distances'][0][i] if results['distances'] else 0.0
-                mem_id = results['ids'][0][i] if results['ids'] else "unknown"
-                
-                # Get timestamp
-                meta = results['metadatas'][0][i] if results['metadatas'] else {}
-                ts = meta.get("timestamp", 0)
-                date_str = "Unknown Date"
-                if ts:
-                    date_str = datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d')
-
-                retrieved_docs_debug.append({
-                    "id": mem_id,
-                    "score": dist,
-                    "content": doc[:50] + "...",
-                    "date": date_str
-                })
-
-                if dist < THRESHOLD:
-                    found_memories.append({
-                        "ts": ts,
-                        "date": date_str,
-                        "doc": doc
-                    })
+        with self._user_memories_lock:
+            generation = self._memory_generation[user_id]
+        results = self._search_local(user_id, embedding)
+        if results is None:
+            results = self.collection.query(
+                query_embeddings=[embedding],
+                n_results=MEMORY_RECALL_COUNT,
+                where={"user_id": user_id},
+                include=["distances", "documents", "metadatas"]  # Never the embeddings
+            )
 
-        # Sort by timestamp descending (newest first)
-        found_memories.sort(key=lambda x: x["ts"], reverse=True)
+        docs = results['documents'][0] if results['documents'] else []
+        n = len(docs)
+        ids = results['ids'][0] if results['ids'] else ["unknown"] * n
+        metas = results['metadatas'][0] if results['metadatas'] else [None] * n
+        dists = np.asarray(results['distances'][0], dtype=np.float64) if results['distances'] else np.zeros(n)
+        ts_arr = np.fromiter(((m or {}).get("timestamp", 0) for m in metas), dtype=np.float64, count=n)
+
+        def date_of(ts: float) -> str:
+            return datetime.datetime.fromtimestamp(ts).strftime('%Y-%m-%d') if ts else "Unknown Date"
+
+        # Accepted candidates, newest first (stable, so ties keep retrieval order)
+        accepted = np.flatnonzero(dists < THRESHOLD)
+        accepted = accepted[np.argsort(-ts_arr[accepted], kind="stable")]
 
-        for mem in found_memories:
-            context_str += f"- [{mem['date']}] {mem['doc']}\n"
-        
         if self.debug:
             print(Fore.CYAN + "\n--- RAG Retrieval Details ---")
             print(f"Query: {query}")
-            print(f"Context Window (Count): {len(found_memories)} / {MEMORY_RECALL_COUNT}")
+            print(f"Context Window (Count): {len(accepted)} / {MEMORY_RECALL_COUNT}")
             print(f"Threshold: {THRESHOLD}")
             print("Candidates:")
-            for item in retrieved_docs_debug:
-                status = f"{Fore.GREEN}ACCEPTED" if item['score'] < THRESHOLD else f"{Fore.RED}REJECTED"
-                print(f"  - ID: {item['id']}")
-                print(f"    Date: {item['date']}")
-                print(f"    Score: {item['score']:.4f} ({status}{Fore.CYAN})")
-                print(f"    Content: {item['content']}")
+            for i in range(n):
+                status = f"{Fore.GREEN}ACCEPTED" if dists[i] < THRESHOLD else f"{Fore.RED}REJECTED"
+                print(f"  - ID: {ids[i]}")
+                print(f"    Date: {date_of(ts_arr[i])}")
+                print(f"    Score: {dists[i]:.4f} ({status}{Fore.CYAN})")
+                print(f"    Content: {docs[i][:50]}...")
             print("-----------------------------" + Style.RESET_ALL)
 
-        if found_memories:
-            context_str = f"{NAME} remembers about you (recent first):\n" + context_str + "\n"
+        context_str = ""
+        if accepted.size:
+            lines = "\n".join(f"- [{date_of(ts_arr[i])}] {docs[i]}" for i in accepted)
+            context_str = f"{NAME} remembers about you (recent first):\n{lines}\n\n"
         
+        with self._user_memories_lock:
+            if self._memory_generation[user_id] == generation:  # No memories stored since the search began
+                self._rag_cache.put(user_id, embedding, context_str)
         return context_str
 
+    def _user_memory_matrix(self, user_id: str):
+        with self._user_memories_lock:
+            if user_id in self._user_memories:
+                self._user_memories.move_to_end(user_id)
+                return self._user_memories[user_id]
+            generation = self._memory_generation[user_id]
+
+        stored = self.collection.get(where={"user_id": user_id}, include=["embeddings", "documents", "metadatas"])
+        entry = None
+        if not stored["ids"]:  # No memories yet; the matrix below can't be shaped from nothing
+            entry = (np.zeros((0, 0), dtype=np.int8), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32), [], [], [])
+        elif len(stored["ids"]) <= LOCAL_SEARCH_MAX_MEMORIES:
+            mat = np.asarray(stored["embeddings"], dtype=np.float32).reshape(len(stored["ids"]), -1)
+            # Kept as int8 with a per-row scale, a quarter of the float32 footprint; norms stay exact
+            scales = np.abs(mat).max(axis=1) / 127
+            scales[scales == 0] = 1.0
+            mat_i8 = np.round(mat / scales[:, None]).astype(np.int8)
+            entry = (mat_i8, scales, np.einsum("ij,ij->i", mat, mat), stored["ids"], stored["documents"], stored["metadatas"])
+
+        with self._user_memories_lock:
+            if self._memory_generation[user_id] == generation:  # Else a store landed mid-fetch; don't cache stale rows
+                self._user_memories[user_id] = entry
+                if len(self._user_memories) > USER_MEMORY_CACHE_USERS:
+                    self._user_memories.popitem(last=False)
+        return entry
+
+    def _search_local(self, user_id: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Brute-force top-k over the user's cached memory matrix, shaped like a collection.query result.
+        Returns None when the user is too large for local search.
+        """
+        entry = self._user_memory_matrix(user_id)
+        if entry is None:
+            return None
+        mat_i8, scales, sq_norms, ids, docs, metas = entry
+        if not ids:
+            return {"ids": [[]], "documents": [[]], "distances": [[]], "metadatas": [[]]}
+
+        # Squared L2, the collection's default space, so THRESHOLD keeps its meaning
+        q = np.asarray(embedding, dtype=np.float32)
+        dists = sq_norms - 2.0 * scales * np.matmul(mat_i8, q, dtype=np.float32) + float(q @ q)
+        k = min(MEMORY_RECALL_COUNT, len(ids))
+        top = np.argpartition(dists, k - 1)[:k]
+        top = top[np.argsort(dists[top])]
+        return {
+            "ids": [[ids[i] for i in top]],
+            "documents": [[docs[i] for i in top]],
+            "distances": [[float(dists[i]) for i in top]],
+            "metadatas": [[metas[i] for i in top]],
+        }
+
     def parse_memories(self, text: str) -> List[Dict[str, str]]:
         if not text:
             return []
-        memories = []
-        parts = text.split("{qa}")
-        for part in parts:
-            if "{answer}" in part:
-                try:
-                    qa, answer = part.split("{answer}", 1)
-                    memories.append({"qa": qa.strip(), "answer": answer.strip()})
-                except ValueError:
-                    continue
-        return memories
+        return [{"qa": m.group(1).strip(), "answer": m.group(2).strip()} for m in MEMORY_RE.finditer(text)]
 
     def _store_memory(self, user_id: str, user_text: str, assistant_response: str):
+        self._store_memories(self._extract_memories(user_id, user_text, assistant_response))
+
+    def _extract_memories(self, user_id: str, user_text: str, assistant_response: str) -> Dict[str, Tuple[str, str]]:
+        """Asks the model for memorable facts in one turn. Returns mem_id -> (user_id, document)."""
         if len(user_text.strip()) < 3:
              self.log("MEMORY", "Skipping memory extraction for short input.", Fore.YELLOW)
-             return
+             return {}
 
         self.log("MEMORY", "Attempting to extract and store new memories...", Fore.MAGENTA)
         chat_content = f"Participating User ID: {user_id}\nUSER: {user_text}\n{NAME}: {assistant_response}\n{MEMORY_PROMPT}"
@@ -336,32 +873,52 @@ class Multimodal:
                 max_tokens=MAX_TOKENS_MEMORY
             )
             extracted_text = extraction.choices[0].message.content
-            
-            if not extracted_text or "NO_MEMORY" in extracted_text:
-                self.log("MEMORY", "No new facts identified (NO_MEMORY).", Fore.YELLOW)
-                return
+        except Exception as e:
+            self.log("MEMORY", f"Memory extraction failed: {e}", Fore.RED)
+            return {}
 
-            self.log("MEMORY", f"Raw extraction: {extracted_text}", Fore.LIGHTBLACK_EX)
-            
-            parsed = self.parse_memories(extracted_text)
-            count = 0
-            for mem in parsed:
-                full_text = f"Q: {mem['qa']} A: {mem['answer']}"
-                mem_id = self.generate_memory_id(full_text + user_id)
-                
-                existing = self.collection.get(ids=[mem_id])
-                if not existing['ids']:
-                    embedding = self.get_embedding(full_text)
-                    if embedding:
-                        self.collection.add(
-                            ids=[mem_id],
-                            documents=[full_text],
-                            embeddings=[embedding],
-                            metadatas=[{"user_id": user_id, "timestamp": time.time()}]
-                        )
-                        count += 1
+        if not extracted_text or "NO_MEMORY" in extracted_text:
+            self.log("MEMORY", "No new facts identified (NO_MEMORY).", Fore.YELLOW)
+            return {}
+
+        self.log("MEMORY", "Raw extraction: %s", Fore.LIGHTBLACK_EX, extracted_text)
+        
+        candidates = {}  # De-duplicated within this extraction
+        for mem in self.parse_memories(extracted_text):
+            full_text = f"Q: {mem['qa']} A: {mem['answer']}"
+            candidates[self.generate_memory_id(full_text, user_id)] = (user_id, full_text)
+        return candidates
+
+    def _store_memories(self, candidates: Dict[str, Tuple[str, str]]):
+        """
+        Stores extracted memories (mem_id -> (user_id, document)) that aren't in the collection yet.
+        One embeddings request and one insert, however many turns they came from.
+        """
+        try:
+            new_memories = {
+                mem_id: (user_id, doc) for mem_id, (user_id, doc) in candidates.items()
+                if mem_id not in self._memory_ids and self._legacy_memory_id(doc, user_id) not in self._memory_ids
+            }
+
+            embeddings = self.get_embeddings([doc for _, doc in new_memories.values()])
+            rows = [(mem_id, user_id, doc, emb) for (mem_id, (user_id, doc)), emb in zip(new_memories.items(), embeddings) if emb]
+            count = len(rows)
+            if rows:
+                now = time.time()
+                self.collection.add(
+                    ids=[r[0] for r in rows],
+                    documents=[r[2] for r in rows],
+                    embeddings=[r[3] for r in rows],
+                    metadatas=[{"user_id": r[1], "timestamp": now} for r in rows]
+                )
+                self._memory_ids.update(r[0] for r in rows)
+                with self._user_memories_lock:
+                    for user_id in {r[1] for r in rows}:
+                        self._memory_generation[user_id] += 1  # Fetches already in flight won't cache
+                        self._rag_cache.invalidate(user_id)  # Cached contexts predate these memories
+                        self._user_memories.pop(user_id, None)
             if count > 0:
-                self.log("MEMORY", f"Stored {count} new memories.", Fore.GREEN)
+                self.log("MEMORY", "Stored %d new memories.", Fore.GREEN, count)
             else:
                 self.log("MEMORY", "No new unique memories to store.", Fore.YELLOW)
                 
@@ -399,8 +956,8 @@ class Multimodal:
                     current_info["summary"] = new_summary
                     current_info["last_interaction"] = time.time()
                     self.karma_db[user_id] = current_info
-                    self._save_json(self.karma_file, self.karma_db)
-                    self.log("SUMMARY", f"Summary updated: {new_summary[:50]}...", Fore.GREEN)
+                    self._mark_karma_dirty(user_id)
+                    self.log("SUMMARY", "Summary updated: %.50s...", Fore.GREEN, new_summary)
                 else:
                     self.log("SUMMARY", "No significant change in summary.", Fore.YELLOW)
             else:
@@ -425,14 +982,17 @@ class Multimodal:
         # We try to be specific to avoid deleting user content mentioning Karma.
         
         # Pattern 1: ($?NUMBER$ Karma) or similar
-        text = re.sub(r'\(?-?\d+\$?\s*Karma\)?', '', text, flags=re.IGNORECASE)
-        
         # Pattern 2: (Karma: NUMBER)
-        text = re.sub(r'\(?Karma:\s*-?\d+\)?', '', text, flags=re.IGNORECASE)
+        # Both are alternatives of KARMA_ARTIFACT_RE, applied in a single pass.
+        text = KARMA_ARTIFACT_RE.sub('', text)
         
         return text.strip()
 
-    def generate_response(self, text: str, image_paths: List[str] = [], user_id: str = "default_user", username: str = None, is_mentioned: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    def _prepare_turn(self, text: str, image_paths: List[str], user_id: str, username: str, is_mentioned: bool, image_bytes: List[bytes]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Runs RAG retrieval and builds the API messages for one turn.
+        Returns the messages and the turn state needed by _finalize_turn.
+        """
         if username:
             self.usernames[user_id] = username
 
@@ -441,8 +1001,8 @@ class Multimodal:
         current_karma = current_karma_info.get("score", 0)
         user_summary = current_karma_info.get("summary", "No summary yet.")
         
-        # 1. RAG Retrieval
-        context_injection = self.retrieve_context(text, user_id)
+        # 1. RAG Retrieval (runs on the RAG pool while the rest of the prompt is built)
+        context_future = self._rag_pool.submit(self.retrieve_context, text, user_id)
         
         # 2. Build Messages
         user_name_info = f" (Name: {username})" if username else ""
@@ -462,12 +1022,17 @@ class Multimodal:
 
         user_context_instruction = f"\nYou are talking to User ID: {user_id}{user_name_info}. <@{user_id}>.\n{behavior_instruction}\n{karma_instruction}\n{summary_instruction}\nIMPORTANT: Use the user's name ({username}) frequently in your response if known."
         
-        system_content = SYSTEM_PROMPT + user_context_instruction + "\n" + context_injection
-        messages = [{"role": "system", "content": system_content}]
+        # Static prompt first and verbatim so the backend can reuse its prefix cache;
+        # per-user context follows, and recalled memories ride on the user turn.
+        messages = [
+            SYSTEM_MESSAGE,
+            {"role": "system", "content": user_context_instruction}
+        ]
         
         # --- RECONSTRUCT HISTORY FOR API ---
         # We need to load images from disk if they exist in history
-        short_term_context = list(history)[-CONTEXT_LENGTH_TEXT:]
+        # Index only the tail of the deque instead of copying the whole history
+        short_term_context = [history[i] for i in range(max(0, len(history) - CONTEXT_LENGTH_TEXT), len(history))]
         for msg in short_term_context:
             role = msg["role"]
             content = msg["content"]
@@ -500,20 +1065,23 @@ class Multimodal:
         user_content = []
         user_content.append({"type": "text", "text": text})
         
-        base64_input_images = []
+        raw_input_images = []  # Kept as bytes for a possible edit call
         input_image_disk_paths = []
         
-        if image_paths:
-            # Enforce Limit
-            processing_paths = image_paths[:MAX_USER_INPUT_IMAGES]
-            
-            for img_path in processing_paths:
-                self.log("INPUT", f"Processing input image: {img_path}", Fore.BLUE)
-                b64 = self._encode_image(img_path)
+        # Uploaded bytes first, then local paths (Enforce Limit)
+        input_images = list(image_bytes or [])[:MAX_USER_INPUT_IMAGES]
+        for img_path in (image_paths or [])[:MAX_USER_INPUT_IMAGES - len(input_images)]:
+            self.log("INPUT", "Processing input image: %s", Fore.BLUE, img_path)
+            input_images.append(self._read_image(img_path))
+
+        if input_images:
+            for data in input_images:
+                data = self._shrink_image(data)
+                b64 = self._to_base64(data)
                 if b64:
-                    base64_input_images.append(b64)
+                    raw_input_images.append(data)
                     # Save to persistent disk
-                    saved_path = self._save_image_to_disk(b64)
+                    saved_path = self._save_image_bytes_to_disk(data)
                     input_image_disk_paths.append(saved_path)
                     # Track
                     self._update_last_images(user_id, saved_path)
@@ -525,59 +1093,61 @@ class Multimodal:
                         }
                     })
             
+        try:
+            context_injection = context_future.result()
+        except Exception as e:  # Memories are extra context; answer without them
+            self.log("ERROR", f"Memory retrieval failed: {e}", Fore.RED)
+            context_injection = ""
+        user_content[0]["text"] = context_injection + text
         messages.append({"role": "user", "content": user_content})
 
         if self.debug:
             print(Fore.BLUE + f"\n--- Context: User '{user_id}' (Karma: {current_karma}) [Mentioned: {is_mentioned}] ---")
 
-        # 3. Call Model
-        self.log("MODEL", f"Sending request for user '{user_id}'...", Fore.CYAN)
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                max_tokens=MAX_TOKENS_RESPONSE
-            )
-            reply = response.choices[0].message.content
-            if reply is None:
-                reply = ""
-            self.log("MODEL", f"Raw Response: {reply}", Fore.LIGHTBLACK_EX)
-        except Exception as e:
-            err_msg = f"Error communicating with AI: {e}"
-            self.log("ERROR", err_msg, Fore.RED)
-            return {"response": err_msg}, {}
+        turn = {
+            "raw_input_images": raw_input_images,
+            "input_image_disk_paths": input_image_disk_paths
+        }
+        return messages, turn
+
+    def _finalize_turn(self, reply: str, text: str, user_id: str, username: str, turn: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Executes the reply's control tags and records the turn in history."""
+        raw_input_images = turn["raw_input_images"]
+        input_image_disk_paths = turn["input_image_disk_paths"]
+        history = self.get_user_history(user_id)
 
         # 4. Check for Triggers
         img_response = None
         final_reply = reply
         
-        # KARMA UPDATES
-        if "{karma+}" in final_reply:
+        # KARMA UPDATES (tags are collected and stripped in the same pass)
+        karma_signs = set()
+        final_reply = KARMA_TAG_RE.sub(lambda m: karma_signs.add(m.group(1)) or "", final_reply).strip()
+        if "+" in karma_signs:
             self.update_karma(user_id, 1, username)
-            final_reply = final_reply.replace("{karma+}", "").strip()
-        elif "{karma-}" in final_reply:
+        elif "-" in karma_signs:
             self.update_karma(user_id, -1, username)
-            final_reply = final_reply.replace("{karma-}", "").strip()
 
         # Clean artifacts
         final_reply = self._clean_response(final_reply)
 
         # IMAGE GENERATION / EDITING
-        gen_match = re.search(r"\{gen\}\s*(.+)", final_reply, re.IGNORECASE | re.DOTALL)
-        edit_match = re.search(r"\{edit\}\s*(.+)", final_reply, re.IGNORECASE | re.DOTALL)
+        action_match = ACTION_TAG_RE.search(final_reply)
+        action = action_match.group(1).lower() if action_match else None
 
-        if gen_match:
+        if action == "gen":
             self.log("ACTION", "Detected Image Generation Intent", Fore.GREEN)
-            keywords = gen_match.group(1).strip()
-            final_reply = final_reply.replace(gen_match.group(0), "").strip()
+            keywords = action_match.group(2).strip()
+            final_reply = final_reply[:action_match.start()].strip()
             
-            self.log("ACTION", f"Generating image with prompt: '{keywords}'", Fore.GREEN)
+            self.log("ACTION", "Generating image with prompt: '%s'", Fore.GREEN, keywords)
             try:
                 gen_res = generate_image(keywords)
                 if gen_res and 'images' in gen_res:
-                    img_response = gen_res['images'][0]
+                    img_bytes = gen_res['images'][0]
+                    img_response = self._to_base64(img_bytes)  # The reply carries base64
                     # Save generated image to disk
-                    saved_path = self._save_image_to_disk(img_response)
+                    saved_path = self._save_image_bytes_to_disk(img_bytes)
                     self._update_last_images(user_id, saved_path) 
                 else:
                     final_reply += "\n[System: Failed to generate image]"
@@ -585,16 +1155,16 @@ class Multimodal:
                 self.log("ERROR", f"Image generation failed: {e}", Fore.RED)
                 final_reply += "\n[System: Error during image generation]"
 
-        elif edit_match:
+        elif action == "edit":
             self.log("ACTION", "Detected Image Edit Intent", Fore.GREEN)
-            keywords = edit_match.group(1).strip()
-            final_reply = final_reply.replace(edit_match.group(0), "").strip()
+            keywords = action_match.group(2).strip()
+            final_reply = final_reply[:action_match.start()].strip()
 
             # Logic: Use input images OR fallback to last known images
-            target_images_b64 = []
+            target_images = []
             
-            if base64_input_images:
-                target_images_b64 = base64_input_images
+            if raw_input_images:
+                target_images = raw_input_images
             else:
                 # Heuristic: Check text for clues like "previous", "first", "old"
                 last_paths = self.last_images.get(user_id, [])
@@ -607,20 +1177,22 @@ class Multimodal:
                     
                     # For now, let's just grab the last 2 if available, or last 1.
                     # This allows the model to see them in the edit request.
-                    paths_to_load = last_paths[-2:] # Take up to last 2
+                    paths_to_load = list(last_paths)[-2:] # Take up to last 2
                     for p in paths_to_load:
-                        b64 = self._load_image_from_disk(p)
-                        if b64:
-                            target_images_b64.append(b64)
+                        # Raw bytes: no base64 round trip before the edit call
+                        data = self._load_image_bytes(p)
+                        if data:
+                            target_images.append(data)
 
-            if target_images_b64:
-                self.log("ACTION", f"Editing image(s) with prompt: '{keywords}'", Fore.GREEN)
+            if target_images:
+                self.log("ACTION", "Editing image(s) with prompt: '%s'", Fore.GREEN, keywords)
                 try:
                     # Pass list of images
-                    gen_res = edit_image(target_images_b64, keywords)
+                    gen_res = edit_image(target_images, keywords)
                     if gen_res and 'images' in gen_res:
-                        img_response = gen_res['images'][0]
-                        saved_path = self._save_image_to_disk(img_response)
+                        img_bytes = gen_res['images'][0]
+                        img_response = self._to_base64(img_bytes)
+                        saved_path = self._save_image_bytes_to_disk(img_bytes)
                         self._update_last_images(user_id, saved_path)
                     else:
                         final_reply += "\n[System: Failed to edit image]"
@@ -651,7 +1223,7 @@ class Multimodal:
                 }
             })
 
-        history.append({"role": "user", "content": user_msg_content})
+        user_msg = {"role": "user", "content": user_msg_content}
         
         # Store Assistant Message
         assistant_text = final_reply
@@ -660,7 +1232,16 @@ class Multimodal:
         
         # Note: Assistant history is Text-Only per API rules. 
         # But we track the generated image in self.last_images (paths) which is enough for editing context.
-        history.append({"role": "assistant", "content": assistant_text}) 
+        assistant_msg = {"role": "assistant", "content": assistant_text}
+
+        # Deque and log are updated together so a compaction never sees one without the other
+        with self._history_lock:
+            history.extend((user_msg, assistant_msg))
+            self._history_pending.append({
+                "user": user_id,
+                "username": self.usernames.get(user_id, "Unknown"),
+                "messages": [user_msg, assistant_msg]
+            })
         
         # Prepare Background Data for Async Processing
         background_data = {
@@ -676,25 +1257,150 @@ class Multimodal:
             
         return result, background_data
 
+    def generate_response(self, text: str, image_paths: List[str] = [], user_id: str = "default_user", username: str = None, is_mentioned: bool = False, image_bytes: List[bytes] = None, max_tokens: int = MAX_TOKENS_RESPONSE) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        messages, turn = self._prepare_turn(text, image_paths, user_id, username, is_mentioned, image_bytes)
+
+        # 3. Call Model
+        self.log("MODEL", "Sending request for user '%s'...", Fore.CYAN, user_id)
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_tokens=max_tokens
+            )
+            reply = response.choices[0].message.content
+            if reply is None:
+                reply = ""
+            self.log("MODEL", "Raw Response: %s", Fore.LIGHTBLACK_EX, reply)
+        except Exception as e:
+            err_msg = f"Error communicating with AI: {e}"
+            self.log("ERROR", err_msg, Fore.RED)
+            return {"response": err_msg}, {}
+
+        return self._finalize_turn(reply, text, user_id, username, turn)
+
+    def generate_response_stream(self, text: str, image_paths: List[str] = [], user_id: str = "default_user", username: str = None, is_mentioned: bool = False, image_bytes: List[bytes] = None, max_tokens: int = MAX_TOKENS_RESPONSE) -> Iterator[Dict[str, Any]]:
+        """
+        Streaming variant of generate_response.
+        Yields {"delta": str} events as the model produces text, then one final
+        {"result": ..., "background": ...} event. Deltas stop at the first "{" since
+        the rest of the reply may be control tags that are handled in _finalize_turn.
+        """
+        # The user's lock is held for preparation and the final commit only, never across a yield:
+        # a client that disconnects mid-stream would otherwise leave it held until the generator is collected
+        with self._user_locks[user_id]:
+            messages, turn = self._prepare_turn(text, image_paths, user_id, username, is_mentioned, image_bytes)
+
+        self.log("MODEL", "Streaming request for user '%s'...", Fore.CYAN, user_id)
+        reply = ""
+        holding = False
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=messages,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                reply += delta
+                if holding or not delta:
+                    continue
+                if "{" in delta:
+                    delta = delta.split("{", 1)[0]
+                    holding = True
+                if delta:
+                    yield {"delta": delta}
+            self.log("MODEL", "Raw Response: %s", Fore.LIGHTBLACK_EX, reply)
+        except Exception as e:
+            err_msg = f"Error communicating with AI: {e}"
+            self.log("ERROR", err_msg, Fore.RED)
+            yield {"result": {"response": err_msg}, "background": {}}
+            return
+
+        with self._user_locks[user_id]:
+            result, background_data = self._finalize_turn(reply, text, user_id, username, turn)
+        yield {"result": result, "background": background_data}
+
+    def generate_response_batch(self, requests: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Generates responses for a batch of requests (each a dict of generate_response kwargs).
+        The chat endpoint has no batched completion call, so requests from different users
+        run concurrently while requests from the same user run in order (they share history).
+        Returns one (result, background_data) tuple per request, or the raised exception.
+        """
+        results: List[Any] = [None] * len(requests)
+        groups: Dict[str, List[int]] = {}
+        for i, req in enumerate(requests):
+            groups.setdefault(req.get("user_id", "default_user"), []).append(i)
+
+        def run_group(user_id: str, indices: List[int]):
+            # Batches from different workers may hold the same user; keep their turns in order
+            with self._user_locks[user_id]:
+                for i in indices:
+                    try:
+                        results[i] = self.generate_response(**requests[i])
+                    except Exception as e:
+                        self.log("ERROR", f"Batched request failed: {e}", Fore.RED)
+                        results[i] = e
+
+        # One embeddings request for every query in the batch; each turn's RAG lookup then hits the cache
+        texts = [req["text"] for req in requests if (req.get("text") or "").strip()]
+        if len(texts) > 1:
+            self.get_embeddings(texts)
+
+        list(self._batch_pool.map(run_group, groups.keys(), groups.values()))
+        return results
+
     def save_memory_background(self, data: Dict[str, Any]):
         """
         Performs background tasks: Saving history to disk, extracting memories, and updating summary.
         This is designed to be run asynchronously or in a background thread/task.
         """
-        user_id = data.get("user_id")
-        text = data.get("text")
-        final_reply = data.get("final_reply")
-        input_image_disk_paths = data.get("input_image_disk_paths", [])
+        self.save_memory_batch([data])
 
+    def save_memory_batch(self, batch: List[Dict[str, Any]]):
+        """
+        Runs save_memory_background for several turns at once.
+        History is written to disk once for the whole batch instead of once per turn.
+        """
         self._save_history()
-        
-        # Store Memory with Image Links
-        image_note = ""
-        if input_image_disk_paths:
-            image_note = f" [User sent images: {', '.join(input_image_disk_paths)}]"
-            
-        self._store_memory(user_id, text + image_note, final_reply)
-        self._update_user_summary(user_id, text, final_reply)
+
+        turns_by_user = {}
+        extractions = []
+        for data in batch:
+            user_id = data.get("user_id")
+            if not user_id:  # Failed turn, nothing to remember
+                continue
+            text = data.get("text")
+            final_reply = data.get("final_reply")
+            input_image_disk_paths = data.get("input_image_disk_paths", [])
+
+            # Store Memory with Image Links
+            image_note = ""
+            if input_image_disk_paths:
+                image_note = f" [User sent images: {', '.join(input_image_disk_paths)}]"
+                
+            extractions.append(self._memory_pool.submit(self._extract_memories, user_id, text + image_note, final_reply))
+            turns_by_user.setdefault(user_id, []).append((text, final_reply))
+
+        # One summary call per user per batch: earlier turns are folded into the prompt's
+        # User/AI lines as a transcript instead of costing a completion each.
+        # Summaries touch one user each, so they run alongside the extractions.
+        summaries = []
+        for user_id, turns in turns_by_user.items():
+            transcript = "".join(f"{t}\nAI: {r}\nUser: " for t, r in turns[:-1]) + turns[-1][0]
+            summaries.append(self._memory_pool.submit(self._update_user_summary, user_id, transcript, turns[-1][1]))
+
+        candidates = {}
+        for future in extractions:
+            candidates.update(future.result())
+        self._store_memories(candidates)
+
+        for future in summaries:
+            future.result()
 
     def generate_text(self, text: str, image_paths: List[str] = [], user_id: str = "default_user", username: str = None, is_mentioned: bool = False) -> Dict[str, Any]:
         """
@@ -6,6 +6,7 @@ from typing import Optional
 class ChatRequest(BaseModel):
     text: str
     image_paths: Optional[list[str]] = []
+    image_files: Optional[list[tuple[str, bytes]]] = []  # (filename, content) held in memory
     user_id: str = "default_user"
     username: Optional[str] = None
     is_mentioned: bool = False
@@ -1,16 +1,37 @@
-from typing import Optional
-import requests
+from typing import Optional, Tuple, AsyncIterator
+import httpx
+import asyncio
+import time
+import aiofiles
+import json
+import mimetypes
 import os
 from dotenv import load_dotenv
 from utils import ChatRequest
+from config import MAX_INFLIGHT_REQUESTS, PROFILE_CACHE_TTL
 
 load_dotenv()
 
-def get_response(request: ChatRequest) -> str:
-    __API = os.getenv("MODEL_API")
-    if not __API:
-        return "Error: MODEL_API not set in .env"
+# Shared async client: keeps connections to the backend alive between messages
+# so concurrent requests overlap on the event loop instead of serializing.
+# The transport retries failed connects (e.g. backend restarting) before giving up.
+HTTPX = httpx.AsyncClient(
+    timeout=60,
+    transport=httpx.AsyncHTTPTransport(
+        retries=3,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+    )
+)
 
+# Bursts beyond this wait here instead of piling onto the API; the API's micro-batcher
+# already coalesces whatever is in flight, so two full batches keep it saturated.
+INFLIGHT = asyncio.Semaphore(MAX_INFLIGHT_REQUESTS)
+
+# user_id -> (expires_at, profile); absorbs repeated /profile calls within PROFILE_CACHE_TTL
+PROFILE_CACHE: dict = {}
+
+async def _build_chat_form(request: ChatRequest) -> Tuple[dict, list]:
+    """Builds the multipart form for the chat endpoints: JSON payload + raw image files."""
     data = {
         "text": request.text,
         "user_id": request.user_id,
@@ -20,12 +41,30 @@ def get_response(request: ChatRequest) -> str:
     
     if request.username:
         data["username"] = request.username
-        
-    if request.image_paths:
-        data["image_paths"] = request.image_paths
-        
+
+    # Images travel as multipart files; paths are only meaningful on this machine
+    files = []
+    for path in request.image_paths or []:
+        async with aiofiles.open(path, "rb") as f:
+            content = await f.read()
+        mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        files.append(("images", (os.path.basename(path), content, mime)))
+    for filename, content in request.image_files or []:
+        mime = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        files.append(("images", (filename, content, mime)))
+
+    return {"payload": json.dumps(data)}, files
+
+async def get_response(request: ChatRequest) -> str:
+    __API = os.getenv("MODEL_API")
+    if not __API:
+        return "Error: MODEL_API not set in .env"
+
     try:
-        response = requests.post(__API, json=data)
+        form, files = await _build_chat_form(request)
+        async with INFLIGHT:
+            response = await HTTPX.post(__API, data=form, files=files or None)
+        PROFILE_CACHE.pop(request.user_id, None)  # The chat turn may have changed karma
         if response.status_code == 200 and response.content:
             try:
                 response_json = response.json()
@@ -40,15 +79,50 @@ def get_response(request: ChatRequest) -> str:
         print(f"Error connecting to API: {e}")
         return f"Error: {e}"
 
-def get_user_profile_data(user_id: str) -> dict:
+async def get_response_stream(request: ChatRequest) -> AsyncIterator[dict]:
+    """
+    Streams a reply from the /chat/stream/ endpoint.
+    Yields {"delta": str} events, then a final {"response": ..., "img": ...} event.
+    """
+    __API = os.getenv("MODEL_API")
+    if not __API:
+        yield {"response": "Error: MODEL_API not set in .env"}
+        return
+    base_url = __API.split("/chat")[0]  # Strip endpoint robustly
+    target_url = f"{base_url}/chat/stream/"
+
+    try:
+        form, files = await _build_chat_form(request)
+        async with INFLIGHT, HTTPX.stream("POST", target_url, data=form, files=files or None) as response:
+            if response.status_code != 200:
+                print(f"Request failed with status code {response.status_code}")
+                yield {"response": "Error: Request failed"}
+                return
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
+        PROFILE_CACHE.pop(request.user_id, None)  # The chat turn may have changed karma
+    except Exception as e:
+        print(f"Error connecting to API: {e}")
+        yield {"response": f"Error: {e}"}
+
+async def get_user_profile_data(user_id: str) -> dict:
+    cached = PROFILE_CACHE.get(user_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
     __API = os.getenv("MODEL_API", "http://127.0.0.1:8119/chat/")
     base_url = __API.split("/chat")[0]  # Strip endpoint robustly
     target_url = f"{base_url}/user/{user_id}/details"
     
     try:
-        resp = requests.get(target_url)
+        resp = await HTTPX.get(target_url)
         if resp.status_code == 200:
-            return resp.json()
+            data = resp.json()
+            if len(PROFILE_CACHE) >= 1024:
+                PROFILE_CACHE.clear()  # Entries only live a few seconds; cheaper than tracking order
+            PROFILE_CACHE[user_id] = (time.monotonic() + PROFILE_CACHE_TTL, data)
+            return data
         else:
             return {"error": f"Failed to fetch profile. API Error: {resp.status_code}"}
     except Exception as e: